@@ -0,0 +1,19 @@
+from flask import request
+
+def version_etag(change_seq):
+    """Formats a record's change_seq as the ETag sent to clients (and expected back in If-Match)."""
+    return f'"{change_seq}"'
+
+def if_match_versions():
+    """Returns the change_seq values accepted by the request's If-Match header, or None if no version check was requested."""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    # Tags that aren't one of our change_seq values can never match
+    return [int(tag) for tag in request.if_match.as_set() if tag.isascii() and tag.isdigit()]
+
+def since_token():
+    """Returns the ?since= change sequence token (0 if absent), or None if it isn't a non-negative integer."""
+    since = request.args.get('since', '0')
+    if not (since.isascii() and since.isdigit()):
+        return None
+    return int(since)
@@ -1,9 +1,17 @@
+from datetime import datetime
+
 from flask import Blueprint, jsonify, request
+from psycopg2.errors import UniqueViolation
+from sqlalchemy.exc import IntegrityError
+
 from app import db  # Import db from the main app
+from apis import if_match_versions, since_token, version_etag
 from models.food import Food  # Import the Food model
 
 food_bp = Blueprint('food_bp', __name__, url_prefix='/food') # Added url_prefix
 
+CHANGES_PAGE_SIZE = 500 # Max rows returned by one /food/changes call
+
 # Create operation: Add a new food item to the database
 @food_bp.route('', methods=['POST'])
 def add_food_item():
@@ -15,10 +23,6 @@ def add_food_item():
     if not all(field in data for field in required_fields):
         return jsonify({"error": "Missing required fields: name, calories"}), 400
 
-    # Check if food item with the same name already exists
-    if Food.query.filter_by(name=data['name']).first():
-        return jsonify({"error": f"Food item with name '{data['name']}' already exists"}), 409 # 409 Conflict
-
     try:
         new_food = Food(
             name=data['name'],
@@ -29,10 +33,16 @@ def add_food_item():
         )
         db.session.add(new_food)
         db.session.commit()
-        return jsonify(new_food.to_dict()), 201
+        return jsonify(new_food.to_dict()), 201, {"ETag": version_etag(new_food.change_seq)}
     except ValueError: # Catches float conversion errors
         db.session.rollback()
         return jsonify({"error": "Invalid data format for numerical fields"}), 400
+    except IntegrityError as e:
+        db.session.rollback()
+        # Name uniqueness is enforced by the uq_food_items_name_live index
+        if isinstance(e.orig, UniqueViolation):
+            return jsonify({"error": f"Food item with name '{data['name']}' already exists"}), 409 # 409 Conflict
+        return jsonify({"error": "Could not add food item"}), 500
     except Exception as e:
         db.session.rollback()
         # Log the exception e
@@ -54,49 +64,85 @@ def get_all_food_items():
         #     "pages": food_items_paginated.pages
         # }), 200
 
-        food_items = Food.query.all()
+        food_items = Food.query.filter_by(deleted_at=None).all()
         return jsonify([food.to_dict() for food in food_items]), 200
     except Exception as e:
         # Log the exception e
         return jsonify({"error": "Could not retrieve food items"}), 500
 
 
+# Read operation: Retrieve inserts/updates/deletes since a change sequence token
+@food_bp.route('/changes', methods=['GET'])
+def get_food_changes():
+    since = since_token()
+    if since is None:
+        return jsonify({"error": "Invalid since token: expected a non-negative integer"}), 400
+    try:
+        changes = Food.query.filter(Food.change_seq > since).order_by(Food.change_seq).limit(CHANGES_PAGE_SIZE).all()
+        return jsonify({
+            "changes": [food.to_change_dict() for food in changes],
+            "next_since": changes[-1].change_seq if changes else since, # Pass back as ?since= on the next sync
+            "has_more": len(changes) == CHANGES_PAGE_SIZE
+        }), 200
+    except Exception as e:
+        # Log the exception e
+        return jsonify({"error": "Could not retrieve food changes"}), 500
+
 # Read operation: Retrieve a specific food item by its ID
 @food_bp.route('/<int:food_id>', methods=['GET'])
 def get_food_item_by_id(food_id):
-    food_item = Food.query.get(food_id)
+    food_item = Food.query.filter_by(id=food_id, deleted_at=None).first()
     if food_item:
-        return jsonify(food_item.to_dict()), 200
+        return jsonify(food_item.to_dict()), 200, {"ETag": version_etag(food_item.change_seq)}
     else:
         return jsonify({"error": "Food item not found"}), 404
 
-# Update operation: Update an existing food item by its ID
-@food_bp.route('/<int:food_id>', methods=['PUT'])
+# Update operation: Update an existing food item by its ID (PUT and PATCH both apply only the fields sent)
+@food_bp.route('/<int:food_id>', methods=['PUT', 'PATCH'])
 def update_food_item(food_id):
-    food_item = Food.query.get(food_id)
-    if not food_item:
-        return jsonify({"error": "Food item not found"}), 404
-
-    data = request.get_json()
+    versions = if_match_versions()
+    data = request.get_json(silent=True)
     if not data:
+        if not _food_item_exists(food_id):
+            return jsonify({"error": "Food item not found"}), 404
         return jsonify({"error": "Invalid input"}), 400
 
-    try:
-        # Check if updating to a name that already exists (and isn't this item itself)
-        if 'name' in data and data['name'] != food_item.name and Food.query.filter_by(name=data['name']).first():
-             return jsonify({"error": f"Food item with name '{data['name']}' already exists"}), 409
-
-        if 'name' in data: food_item.name = data['name']
-        if 'calories' in data: food_item.calories = float(data['calories'])
-        if 'protein' in data: food_item.protein = data.get('protein')
-        if 'carbohydrates' in data: food_item.carbohydrates = data.get('carbohydrates')
-        if 'fat' in data: food_item.fat = data.get('fat')
+    conditions = [Food.id == food_id, Food.deleted_at.is_(None)]
+    if versions is not None:
+        conditions.append(Food.change_seq.in_(versions))
 
+    try:
+        values = {}
+        if 'name' in data: values['name'] = data['name']
+        if 'calories' in data: values['calories'] = float(data['calories'])
+        if 'protein' in data: values['protein'] = data.get('protein')
+        if 'carbohydrates' in data: values['carbohydrates'] = data.get('carbohydrates')
+        if 'fat' in data: values['fat'] = data.get('fat')
+
+        if values:
+            # Single UPDATE ... RETURNING; name uniqueness is enforced by the uq_food_items_name_live index
+            stmt = db.update(Food).where(*conditions).values(**values).returning(Food)
+        else:
+            # Nothing to change: answer with the current item, as before
+            stmt = db.select(Food).where(*conditions)
+        food_item = db.session.execute(stmt).scalar_one_or_none()
+        if not food_item:
+            db.session.rollback()
+            return _food_item_missing_or_modified(food_id, versions)
+
+        result = food_item.to_dict() # Serialize before commit expires the instance
         db.session.commit()
-        return jsonify(food_item.to_dict()), 200
+        return jsonify(result), 200, {"ETag": version_etag(result['change_seq'])}
     except ValueError: # Catches float conversion errors
         db.session.rollback()
+        if not _food_item_exists(food_id):
+            return jsonify({"error": "Food item not found"}), 404
         return jsonify({"error": "Invalid data format for numerical fields"}), 400
+    except IntegrityError as e:
+        db.session.rollback()
+        if isinstance(e.orig, UniqueViolation):
+            return jsonify({"error": f"Food item with name '{data['name']}' already exists"}), 409
+        return jsonify({"error": "Could not update food item"}), 500
     except Exception as e:
         db.session.rollback()
         # Log the exception e
@@ -105,15 +151,30 @@ def update_food_item(food_id):
 # Delete operation: Delete a specific food item by its ID
 @food_bp.route('/<int:food_id>', methods=['DELETE'])
 def delete_food_item(food_id):
-    food_item = Food.query.get(food_id)
-    if not food_item:
-        return jsonify({"error": "Food item not found"}), 404
-
     try:
-        db.session.delete(food_item)
+        # Soft delete: keep the row as a tombstone so sync clients see the deletion
+        stmt = db.update(Food).where(Food.id == food_id, Food.deleted_at.is_(None))
+        versions = if_match_versions()
+        if versions is not None:
+            stmt = stmt.where(Food.change_seq.in_(versions))
+        deleted_id = db.session.execute(stmt.values(deleted_at=datetime.utcnow()).returning(Food.id)).scalar_one_or_none()
+        if deleted_id is None:
+            db.session.rollback()
+            return _food_item_missing_or_modified(food_id, versions)
+
         db.session.commit()
         return jsonify({"message": "Food item deleted successfully"}), 200
     except Exception as e:
         db.session.rollback()
         # Log the exception e
         return jsonify({"error": "Could not delete food item"}), 500
+
+def _food_item_exists(food_id):
+    """Checks for a live food item; body errors are only reported for items that exist, 404 comes first."""
+    return db.session.query(Food.id).filter_by(id=food_id, deleted_at=None).first() is not None
+
+def _food_item_missing_or_modified(food_id, versions):
+    """Builds the error response for a write that matched no row: 412 if only the If-Match version was stale, else 404."""
+    if versions is not None and _food_item_exists(food_id):
+        return jsonify({"error": "Food item has been modified"}), 412
+    return jsonify({"error": "Food item not found"}), 404
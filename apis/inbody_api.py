@@ -1,10 +1,15 @@
+from datetime import datetime
+
 from flask import Blueprint, jsonify, request
+
 from app import db # Import db from the main app
-from models.inbody import InBody # Import the InBody model
-from datetime import datetime
+from apis import if_match_versions, since_token, version_etag
+from models.inbody import InBody, inbody_change_seq_next_value # Import the InBody model
 
 inbody_bp = Blueprint('inbody_bp', __name__, url_prefix='/inbody') # Added url_prefix
 
+CHANGES_PAGE_SIZE = 500 # Max rows returned by one /inbody/user/<user_id>/changes call
+
 # Create operation: Add new in-body information
 @inbody_bp.route('', methods=['POST'])
 def add_inbody_record():
@@ -25,11 +30,12 @@ def add_inbody_record():
             muscle_mass=data.get('muscle_mass'),
             # measurement_date is handled by default in model if not provided
             # If provided, it should be in ISO format.
-            measurement_date=datetime.fromisoformat(data['measurement_date']) if data.get('measurement_date') else datetime.utcnow()
+            measurement_date=datetime.fromisoformat(data['measurement_date']) if data.get('measurement_date') else datetime.utcnow(),
+            change_seq=inbody_change_seq_next_value(data['user_id'])
         )
         db.session.add(new_record)
         db.session.commit()
-        return jsonify(new_record.to_dict()), 201
+        return jsonify(new_record.to_dict()), 201, {"ETag": version_etag(new_record.change_seq)}
     except ValueError as e: # Catches float conversion errors or date parsing errors
         db.session.rollback()
         return jsonify({"error": f"Invalid data format: {e}"}), 400
@@ -41,44 +47,86 @@ def add_inbody_record():
 # Read operation: Retrieve all in-body records for a specific user
 @inbody_bp.route('/user/<string:user_id>', methods=['GET'])
 def get_inbody_records_for_user(user_id):
-    records = InBody.query.filter_by(user_id=user_id).order_by(InBody.measurement_date.desc()).all()
+    records = InBody.query.filter_by(user_id=user_id, deleted_at=None).order_by(InBody.measurement_date.desc()).all()
     if records:
         return jsonify([record.to_dict() for record in records]), 200
     else:
         # Return empty list if no records, not a 404, as the user might exist but have no records
         return jsonify([]), 200
 
+# Read operation: Retrieve a user's inserts/updates/deletes since a change sequence token
+@inbody_bp.route('/user/<string:user_id>/changes', methods=['GET'])
+def get_inbody_changes_for_user(user_id):
+    since = since_token()
+    if since is None:
+        return jsonify({"error": "Invalid since token: expected a non-negative integer"}), 400
+    try:
+        changes = InBody.query.filter(InBody.user_id == user_id, InBody.change_seq > since) \
+            .order_by(InBody.change_seq).limit(CHANGES_PAGE_SIZE).all()
+        return jsonify({
+            "changes": [record.to_change_dict() for record in changes],
+            "next_since": changes[-1].change_seq if changes else since, # Pass back as ?since= on the next sync
+            "has_more": len(changes) == CHANGES_PAGE_SIZE
+        }), 200
+    except Exception as e:
+        # Log the exception e
+        return jsonify({"error": "Could not retrieve record changes"}), 500
+
 # Read operation: Retrieve a specific in-body record by its ID
 @inbody_bp.route('/<int:record_id>', methods=['GET'])
 def get_inbody_record_by_id(record_id):
-    record = InBody.query.get(record_id)
+    record = InBody.query.filter_by(id=record_id, deleted_at=None).first()
     if record:
-        return jsonify(record.to_dict()), 200
+        return jsonify(record.to_dict()), 200, {"ETag": version_etag(record.change_seq)}
     else:
         return jsonify({"error": "Record not found"}), 404
 
-# Update operation: Update an existing in-body record by its ID
-@inbody_bp.route('/<int:record_id>', methods=['PUT'])
+# Update operation: Update an existing in-body record by its ID (PUT and PATCH both apply only the fields sent)
+@inbody_bp.route('/<int:record_id>', methods=['PUT', 'PATCH'])
 def update_inbody_record(record_id):
-    record = InBody.query.get(record_id)
-    if not record:
-        return jsonify({"error": "Record not found"}), 404
-
-    data = request.get_json()
+    versions = if_match_versions()
+    data = request.get_json(silent=True)
     if not data:
+        if not _record_exists(record_id):
+            return jsonify({"error": "Record not found"}), 404
         return jsonify({"error": "Invalid input"}), 400
+    if 'user_id' in data and not isinstance(data['user_id'], str):
+        if not _record_exists(record_id):
+            return jsonify({"error": "Record not found"}), 404
+        return jsonify({"error": "Invalid data format: user_id must be a string"}), 400
+
+    conditions = [InBody.id == record_id, InBody.deleted_at.is_(None)]
+    if 'user_id' in data:
+        # Records can't move between users: the old owner's changes feed would never get a tombstone
+        conditions.append(InBody.user_id == data['user_id'])
+    if versions is not None:
+        conditions.append(InBody.change_seq.in_(versions))
 
     try:
-        if 'user_id' in data: record.user_id = data['user_id']
-        if 'weight' in data: record.weight = float(data['weight'])
-        if 'body_fat_percentage' in data: record.body_fat_percentage = data.get('body_fat_percentage')
-        if 'muscle_mass' in data: record.muscle_mass = data.get('muscle_mass')
-        if 'measurement_date' in data: record.measurement_date = datetime.fromisoformat(data['measurement_date'])
+        values = {}
+        if 'weight' in data: values['weight'] = float(data['weight'])
+        if 'body_fat_percentage' in data: values['body_fat_percentage'] = data.get('body_fat_percentage')
+        if 'muscle_mass' in data: values['muscle_mass'] = data.get('muscle_mass')
+        if 'measurement_date' in data: values['measurement_date'] = datetime.fromisoformat(data['measurement_date'])
+
+        if values:
+            # Single UPDATE ... RETURNING instead of load, mutate, commit
+            stmt = db.update(InBody).where(*conditions).values(**values).returning(InBody)
+        else:
+            # Nothing to change: answer with the current record, as before
+            stmt = db.select(InBody).where(*conditions)
+        record = db.session.execute(stmt).scalar_one_or_none()
+        if not record:
+            db.session.rollback()
+            return _record_missing_or_modified(record_id, versions, user_id_sent='user_id' in data, user_id=data.get('user_id'))
 
+        result = record.to_dict() # Serialize before commit expires the instance
         db.session.commit()
-        return jsonify(record.to_dict()), 200
+        return jsonify(result), 200, {"ETag": version_etag(result['change_seq'])}
     except ValueError as e: # Catches float conversion errors or date parsing errors
         db.session.rollback()
+        if not _record_exists(record_id):
+            return jsonify({"error": "Record not found"}), 404
         return jsonify({"error": f"Invalid data format: {e}"}), 400
     except Exception as e:
         db.session.rollback()
@@ -88,15 +136,35 @@ def update_inbody_record(record_id):
 # Delete operation: Delete a specific in-body record by its ID
 @inbody_bp.route('/<int:record_id>', methods=['DELETE'])
 def delete_inbody_record(record_id):
-    record = InBody.query.get(record_id)
-    if not record:
-        return jsonify({"error": "Record not found"}), 404
-
     try:
-        db.session.delete(record)
+        # Soft delete: keep the row as a tombstone so sync clients see the deletion
+        stmt = db.update(InBody).where(InBody.id == record_id, InBody.deleted_at.is_(None))
+        versions = if_match_versions()
+        if versions is not None:
+            stmt = stmt.where(InBody.change_seq.in_(versions))
+        deleted_id = db.session.execute(stmt.values(deleted_at=datetime.utcnow()).returning(InBody.id)).scalar_one_or_none()
+        if deleted_id is None:
+            db.session.rollback()
+            return _record_missing_or_modified(record_id, versions)
+
         db.session.commit()
         return jsonify({"message": "Record deleted successfully"}), 200
     except Exception as e:
         db.session.rollback()
         # Log the exception e
         return jsonify({"error": "Could not delete record"}), 500
+
+def _record_exists(record_id):
+    """Checks for a live record; body errors are only reported for records that exist, 404 comes first."""
+    return db.session.query(InBody.id).filter_by(id=record_id, deleted_at=None).first() is not None
+
+def _record_missing_or_modified(record_id, versions, *, user_id_sent=False, user_id=None):
+    """Builds the error response for a write that matched no row: 404, 400 for a user_id change, or 412 for a stale If-Match version."""
+    if versions is None and not user_id_sent:
+        return jsonify({"error": "Record not found"}), 404
+    record = db.session.query(InBody.user_id).filter_by(id=record_id, deleted_at=None).first()
+    if not record:
+        return jsonify({"error": "Record not found"}), 404
+    if user_id_sent and record.user_id != user_id:
+        return jsonify({"error": "user_id cannot be changed; create a new record for the other user"}), 400
+    return jsonify({"error": "Record has been modified"}), 412
@@ -1,3 +1,25 @@
 # This line imports the db instance from your main app module (app.py)
 # This allows your models to use the same SQLAlchemy instance.
 from app import db
+
+def change_seq_next_value(sequence, lock_key):
+    """Returns a SQL expression drawing the next change_seq from `sequence`, for use in an INSERT or UPDATE.
+
+    nextval() hands out numbers when a statement runs, not when it commits, so overlapping writers
+    could commit out of order and a sync client holding the higher token would never see the lower
+    row. The number is therefore drawn under a transaction-scoped advisory lock on `lock_key`:
+    writers sharing a key take numbers one at a time and hold the lock until commit, so within one
+    changes feed change_seq order is commit order. Writers with different keys don't wait on each
+    other, so the key should be no wider than the feed that reads the numbers.
+    """
+    return db.select(sequence.next_value()) \
+        .select_from(db.func.pg_advisory_xact_lock(db.func.hashtext(lock_key))).scalar_subquery()
+
+class ChangeFeedMixin:
+    """Adds serialization for changes feed entries to models with change_seq/deleted_at columns."""
+
+    def to_change_dict(self):
+        """Serializes the object as a changes feed entry: to_dict() for live rows, a bare tombstone for deleted ones."""
+        if self.deleted_at:
+            return {'id': self.id, 'change_seq': self.change_seq, 'deleted': True}
+        return dict(self.to_dict(), deleted=False)
@@ -1,14 +1,25 @@
-from . import db  # Import db from models/__init__.py
+from . import ChangeFeedMixin, change_seq_next_value, db  # Import db from models/__init__.py
 
-class Food(db.Model):
+# Monotonically increasing change counter, bumped on every insert/update (incl. soft deletes)
+food_change_seq = db.Sequence('food_items_change_seq', metadata=db.metadata)
+# /food/changes is a single global feed, so all food writers share one lock
+food_change_seq_next_value = change_seq_next_value(food_change_seq, 'food_items_change_seq')
+
+class Food(ChangeFeedMixin, db.Model):
     __tablename__ = 'food_items'
+    __table_args__ = (
+        # Food names should be unique among live items; tombstones don't block re-adding a name
+        db.Index('uq_food_items_name_live', 'name', unique=True, postgresql_where=db.text('deleted_at IS NULL')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False, unique=True) # Food names should be unique
+    name = db.Column(db.String(100), nullable=False)
     calories = db.Column(db.Float, nullable=False) # Per serving or standard unit (e.g., 100g)
     protein = db.Column(db.Float, nullable=True) # In grams
     carbohydrates = db.Column(db.Float, nullable=True) # In grams
     fat = db.Column(db.Float, nullable=True) # In grams
+    change_seq = db.Column(db.BigInteger, nullable=False, default=food_change_seq_next_value, index=True, onupdate=food_change_seq_next_value)
+    deleted_at = db.Column(db.DateTime, nullable=True) # Set instead of deleting the row (tombstone for sync clients)
 
     def __repr__(self):
         return f'<Food {self.name}>'
@@ -21,5 +32,6 @@ class Food(db.Model):
             'calories': self.calories,
             'protein': self.protein,
             'carbohydrates': self.carbohydrates,
-            'fat': self.fat
+            'fat': self.fat,
+            'change_seq': self.change_seq
         }
@@ -1,8 +1,23 @@
-from . import db  # Import db from models/__init__.py
+from . import ChangeFeedMixin, change_seq_next_value, db  # Import db from models/__init__.py
 from datetime import datetime
 
-class InBody(db.Model):
+# Monotonically increasing change counter, bumped on every insert/update (incl. soft deletes)
+inbody_change_seq = db.Sequence('inbody_records_change_seq', metadata=db.metadata)
+
+def inbody_change_seq_next_value(user_id):
+    """Returns the change_seq expression for a write to one of a user's records.
+
+    The changes feed is per user and records can't change owner, so only writers for the same
+    user_id share a lock. Pass the user_id value for INSERTs, or the user_id column for UPDATEs.
+    """
+    return change_seq_next_value(inbody_change_seq, db.literal('inbody_records_change_seq:') + user_id)
+
+class InBody(ChangeFeedMixin, db.Model):
     __tablename__ = 'inbody_records'
+    __table_args__ = (
+        # Serves the per-user changes feed (user_id = ? AND change_seq > ? ORDER BY change_seq)
+        db.Index('ix_inbody_records_user_id_change_seq', 'user_id', 'change_seq'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(80), nullable=False) # Assuming user_id is a string, adjust if it's a foreign key to a users table
@@ -10,6 +25,9 @@ class InBody(db.Model):
     body_fat_percentage = db.Column(db.Float, nullable=True)
     muscle_mass = db.Column(db.Float, nullable=True)
     measurement_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Set by add_inbody_record on insert, since the lock key depends on the new row's user_id
+    change_seq = db.Column(db.BigInteger, nullable=False, onupdate=inbody_change_seq_next_value(user_id))
+    deleted_at = db.Column(db.DateTime, nullable=True) # Set instead of deleting the row (tombstone for sync clients)
 
     def __repr__(self):
         return f'<InBody {self.id} for user {self.user_id} on {self.measurement_date}>'
@@ -22,5 +40,6 @@ class InBody(db.Model):
             'weight': self.weight,
             'body_fat_percentage': self.body_fat_percentage,
             'muscle_mass': self.muscle_mass,
-            'measurement_date': self.measurement_date.isoformat() if self.measurement_date else None
+            'measurement_date': self.measurement_date.isoformat() if self.measurement_date else None,
+            'change_seq': self.change_seq
         }
@@ -376,3 +376,188 @@ def test_delete_food_item_not_found(client): # Renamed
 # Removed:
 # test_delete_food_record_user_not_found
 # test_delete_multiple_food_records_and_check_indices (indices no longer primary identifiers)
+
+
+# === Test Delta-Sync (changes feed) ===
+def test_get_inbody_changes_since_token(client):
+    record_id_1 = json.loads(client.post('/inbody', json=sample_inbody_payload_1).data)['id']
+    client.post('/inbody', json=sample_inbody_payload_user2) # Other user's record must not show up
+
+    response = client.get(f"/inbody/user/{sample_inbody_payload_1['user_id']}/changes")
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [change['id'] for change in data['changes']] == [record_id_1]
+    since = data['next_since']
+
+    record_id_2 = json.loads(client.post('/inbody', json=sample_inbody_payload_2).data)['id']
+    client.put(f'/inbody/{record_id_1}', json={"weight": 69.0})
+
+    response = client.get(f"/inbody/user/{sample_inbody_payload_1['user_id']}/changes?since={since}")
+    data = json.loads(response.data)
+    assert [change['id'] for change in data['changes']] == [record_id_2, record_id_1]
+    assert data['changes'][1]['weight'] == 69.0
+    assert data['changes'][1]['deleted'] is False
+
+    # Nothing new since the latest token
+    response = client.get(f"/inbody/user/{sample_inbody_payload_1['user_id']}/changes?since={data['next_since']}")
+    data = json.loads(response.data)
+    assert data['changes'] == []
+    assert data['has_more'] is False
+
+def test_get_inbody_changes_includes_tombstones(client):
+    record_id = json.loads(client.post('/inbody', json=sample_inbody_payload_1).data)['id']
+    since = json.loads(client.get(f"/inbody/user/{sample_inbody_payload_1['user_id']}/changes").data)['next_since']
+
+    client.delete(f'/inbody/{record_id}')
+
+    response = client.get(f"/inbody/user/{sample_inbody_payload_1['user_id']}/changes?since={since}")
+    data = json.loads(response.data)
+    assert len(data['changes']) == 1
+    assert data['changes'][0]['id'] == record_id
+    assert data['changes'][0]['deleted'] is True
+
+    # Tombstones stay hidden from the regular endpoints
+    assert json.loads(client.get(f"/inbody/user/{sample_inbody_payload_1['user_id']}").data) == []
+    assert client.delete(f'/inbody/{record_id}').status_code == 404
+
+def test_update_inbody_record_cannot_move_to_other_user(client):
+    record_id = json.loads(client.post('/inbody', json=sample_inbody_payload_1).data)['id']
+    old_owner_since = json.loads(client.get(f"/inbody/user/{sample_inbody_payload_1['user_id']}/changes").data)['next_since']
+
+    response = client.put(f'/inbody/{record_id}', json={"user_id": sample_inbody_payload_user2['user_id'], "weight": 60.0})
+    assert response.status_code == 400
+    assert "user_id cannot be changed" in json.loads(response.data)['error']
+
+    # Neither feed changed: the old owner keeps the record, the new owner never gets it
+    old_owner_changes = json.loads(client.get(f"/inbody/user/{sample_inbody_payload_1['user_id']}/changes?since={old_owner_since}").data)
+    assert old_owner_changes['changes'] == []
+    new_owner_changes = json.loads(client.get(f"/inbody/user/{sample_inbody_payload_user2['user_id']}/changes").data)
+    assert new_owner_changes['changes'] == []
+    assert json.loads(client.get(f'/inbody/{record_id}').data)['weight'] == sample_inbody_payload_1['weight']
+
+    # Sending the current owner is still fine
+    response = client.put(f'/inbody/{record_id}', json={"user_id": sample_inbody_payload_1['user_id'], "weight": 60.0})
+    assert response.status_code == 200
+    assert json.loads(response.data)['weight'] == 60.0
+
+def test_update_inbody_record_rejects_non_string_user_id(client):
+    record_id = json.loads(client.post('/inbody', json=sample_inbody_payload_1).data)['id']
+
+    for user_id in [None, 5]:
+        response = client.put(f'/inbody/{record_id}', json={"user_id": user_id, "weight": 60.0})
+        assert response.status_code == 400
+        assert "user_id must be a string" in json.loads(response.data)['error']
+    assert json.loads(client.get(f'/inbody/{record_id}').data)['weight'] == sample_inbody_payload_1['weight']
+
+def test_get_changes_invalid_since_token(client):
+    for since in ["abc", "-1", "1.5", "\u00b2"]:
+        response = client.get('/food/changes', query_string={"since": since})
+        assert response.status_code == 400
+        assert "Invalid since token" in json.loads(response.data)['error']
+        response = client.get('/inbody/user/user1/changes', query_string={"since": since})
+        assert response.status_code == 400
+
+def test_get_food_changes_since_token(client):
+    food_id_1 = json.loads(client.post('/food', json=sample_food_payload_1).data)['id']
+    food_id_2 = json.loads(client.post('/food', json=sample_food_payload_2).data)['id']
+
+    response = client.get('/food/changes')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert [change['id'] for change in data['changes']] == [food_id_1, food_id_2]
+    since = data['next_since']
+
+    client.put(f'/food/{food_id_2}', json={"calories": 170})
+    client.delete(f'/food/{food_id_1}')
+
+    response = client.get(f'/food/changes?since={since}')
+    data = json.loads(response.data)
+    assert [change['id'] for change in data['changes']] == [food_id_2, food_id_1]
+    assert data['changes'][0]['calories'] == 170
+    assert data['changes'][1] == {"id": food_id_1, "change_seq": data['next_since'], "deleted": True}
+
+def test_add_food_item_reuses_name_of_deleted_item(client):
+    food_id = json.loads(client.post('/food', json=sample_food_payload_1).data)['id']
+    client.delete(f'/food/{food_id}')
+
+    response = client.post('/food', json=sample_food_payload_1)
+    assert response.status_code == 201
+    assert json.loads(response.data)['id'] != food_id
+
+
+# === Test PATCH and If-Match Optimistic Concurrency ===
+def test_patch_inbody_record_with_matching_if_match(client):
+    post_response = client.post('/inbody', json=sample_inbody_payload_1)
+    record_id = json.loads(post_response.data)['id']
+    etag = post_response.headers['ETag']
+
+    response = client.patch(f'/inbody/{record_id}', json={"muscle_mass": 31.0}, headers={"If-Match": etag})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['muscle_mass'] == 31.0
+    assert data['weight'] == sample_inbody_payload_1['weight'] # Unchanged field
+    assert response.headers['ETag'] != etag
+
+def test_update_inbody_record_stale_if_match(client):
+    post_response = client.post('/inbody', json=sample_inbody_payload_1)
+    record_id = json.loads(post_response.data)['id']
+    etag = post_response.headers['ETag']
+    client.put(f'/inbody/{record_id}', json={"weight": 72.0}) # Concurrent writer bumps the version
+
+    response = client.patch(f'/inbody/{record_id}', json={"weight": 73.0}, headers={"If-Match": etag})
+    assert response.status_code == 412
+    assert client.delete(f'/inbody/{record_id}', headers={"If-Match": etag}).status_code == 412
+    assert json.loads(client.get(f'/inbody/{record_id}').data)['weight'] == 72.0
+
+    response = client.patch('/inbody/99999', json={"weight": 73.0}, headers={"If-Match": etag})
+    assert response.status_code == 404
+
+def test_patch_food_item_with_matching_if_match(client):
+    post_response = client.post('/food', json=sample_food_payload_1)
+    food_id = json.loads(post_response.data)['id']
+
+    get_response = client.get(f'/food/{food_id}')
+    response = client.patch(f'/food/{food_id}', json={"fat": 0.4}, headers={"If-Match": get_response.headers['ETag']})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['fat'] == 0.4
+    assert data['name'] == sample_food_payload_1['name'] # Unchanged field
+
+def test_update_food_item_stale_if_match(client):
+    post_response = client.post('/food', json=sample_food_payload_1)
+    food_id = json.loads(post_response.data)['id']
+    etag = post_response.headers['ETag']
+    client.patch(f'/food/{food_id}', json={"calories": 90}) # Concurrent writer bumps the version
+
+    response = client.put(f'/food/{food_id}', json={"calories": 100}, headers={"If-Match": etag})
+    assert response.status_code == 412
+    data = json.loads(response.data)
+    assert data['error'] == "Food item has been modified"
+
+    response = client.delete(f'/food/{food_id}', headers={"If-Match": etag})
+    assert response.status_code == 412
+
+    response = client.delete(f'/food/{food_id}', headers={"If-Match": client.get(f'/food/{food_id}').headers['ETag']})
+    assert response.status_code == 200
+
+def test_update_missing_item_reports_404_before_body_errors(client):
+    assert client.put('/food/99999', json={"calories": "not-a-number"}).status_code == 404
+    assert client.patch('/food/99999').status_code == 404
+    assert client.put('/inbody/99999', json={"measurement_date": "not-a-date"}).status_code == 404
+    assert client.patch('/inbody/99999', json={"unknown_field": 1}).status_code == 404
+
+def test_update_without_known_fields_returns_current_item(client):
+    post_response = client.post('/food', json=sample_food_payload_1)
+    food_id = json.loads(post_response.data)['id']
+
+    response = client.put(f'/food/{food_id}', json={"unknown_field": 1})
+    assert response.status_code == 200
+    assert json.loads(response.data) == json.loads(post_response.data)
+    assert response.headers['ETag'] == post_response.headers['ETag'] # Nothing written, version unchanged
+
+def test_non_ascii_digit_if_match_never_matches(client):
+    food_id = json.loads(client.post('/food', json=sample_food_payload_1).data)['id']
+    record_id = json.loads(client.post('/inbody', json=sample_inbody_payload_1).data)['id']
+
+    assert client.delete(f'/food/{food_id}', headers={"If-Match": '"²"'}).status_code == 412
+    assert client.patch(f'/inbody/{record_id}', json={"weight": 60.0}, headers={"If-Match": '"²"'}).status_code == 412